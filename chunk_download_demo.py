@@ -10,105 +10,146 @@ import time
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import argparse
+from pathlib import Path
+from http_utils import check_range_response
+from config import NETWORK_CONFIG
 
 class ChunkDownloadDemo:
     def __init__(self, max_threads=4, chunk_size=1024*1024):
         self.max_threads = max_threads
         self.chunk_size = chunk_size
+        self.max_range = 2 * chunk_size  # 合并相邻区间后的最大请求大小
         self.progress_lock = threading.Lock()
         self.total_downloaded = 0
         self.total_size = 0
         self.start_time = None
         self.chunk_progress = {}
+        self._inv_mb = 1.0 / (1024 * 1024)  # 以乘法代替进度计算中的除法
         
-    def test_url_support(self, url):
-        """测试URL是否支持Range请求"""
+        # 预先生成所有可能的进度条，进度刷新时直接查表
+        self.bar_width = 20
+        self._bars = [f"[{'█' * i}{'░' * (self.bar_width - i)}]" for i in range(self.bar_width + 1)]
+        
+        # 所有数据块共享一个连接池，复用TCP/TLS连接
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_threads,
+            pool_maxsize=max_threads,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if NETWORK_CONFIG.get('user_agent'):
+            self.session.headers['User-Agent'] = NETWORK_CONFIG['user_agent']
+        
+    def probe(self, url):
+        """用一次 Range: bytes=0-0 的HEAD请求检测Range支持和文件大小"""
         try:
-            headers = {'Range': 'bytes=0-1023'}
-            response = requests.head(url, headers=headers, timeout=10)
+            headers = {'Range': 'bytes=0-0'}
+            response = self.session.head(url, headers=headers, timeout=10, allow_redirects=True)
             
             if response.status_code == 206:
                 print(f"✅ 服务器支持Range请求 (状态码: {response.status_code})")
-                return True
-            elif response.status_code == 200:
-                support = 'accept-ranges' in response.headers
-                if support:
-                    print(f"✅ 服务器支持Range请求 (Accept-Ranges: {response.headers.get('accept-ranges')})")
-                else:
-                    print(f"❌ 服务器不支持Range请求")
-                return support
+                supports_range = True
+            elif response.status_code == 200 and 'accept-ranges' in response.headers:
+                print(f"✅ 服务器支持Range请求 (Accept-Ranges: {response.headers.get('accept-ranges')})")
+                supports_range = True
             else:
                 print(f"❌ 服务器不支持Range请求 (状态码: {response.status_code})")
-                return False
-                
-        except Exception as e:
-            print(f"❌ 测试Range支持失败: {str(e)}")
-            return False
-    
-    def get_file_size(self, url):
-        """获取文件大小"""
-        try:
-            response = requests.head(url, timeout=10)
+                supports_range = False
             
-            if 'content-length' in response.headers:
+            size = 0
+            if 'content-range' in response.headers:
+                size = int(response.headers['content-range'].split('/')[-1])
+            elif response.status_code == 200 and 'content-length' in response.headers:
                 size = int(response.headers['content-length'])
+            
+            if size:
                 print(f"📊 文件大小: {size / (1024*1024):.2f} MB ({size:,} 字节)")
-                return size
             else:
                 print("❌ 无法获取文件大小")
-                return 0
+            
+            return supports_range, size
                 
         except Exception as e:
-            print(f"❌ 获取文件大小失败: {str(e)}")
-            return 0
+            print(f"❌ 探测服务器失败: {str(e)}")
+            return False, 0
     
-    def download_chunk(self, url, start, end, chunk_id, temp_dir):
-        """下载单个数据块"""
+    def split_ranges(self, file_size):
+        """按固定大小切分下载区间，并合并过小的相邻区间"""
+        ranges = []
+        for start in range(0, file_size, self.chunk_size):
+            end = min(start + self.chunk_size, file_size) - 1
+            if (ranges and end - start + 1 < self.chunk_size and
+                    end - ranges[-1][0] + 1 <= self.max_range):
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+    
+    def download_chunk(self, url, start, end, chunk_id, fd):
+        """下载单个数据块，直接写入输出文件的对应偏移位置"""
         headers = {'Range': f'bytes={start}-{end}'}
-        chunk_file = os.path.join(temp_dir, f'chunk_{chunk_id:04d}.tmp')
         
-        print(f"🔄 线程 {chunk_id}: 开始下载字节 {start:,} - {end:,}")
+        print(f"🔄 数据块 {chunk_id}: 开始下载字节 {start:,} - {end:,}")
+        
+        expected_size = end - start + 1
+        chunk_size_downloaded = 0
         
         try:
-            response = requests.get(url, headers=headers, stream=True, timeout=30)
+            response = self.session.get(url, headers=headers, stream=True, timeout=30)
             response.raise_for_status()
+            check_range_response(response.status_code, response.headers, start)
+            
+            # 整块预分配缓冲区，按1MB切片直接读入，避免逐个8KB创建bytes对象
+            buffer = bytearray(expected_size)
+            view = memoryview(buffer)
+            raw = response.raw
+            raw.decode_content = True
             
-            chunk_size_downloaded = 0
-            expected_size = end - start + 1
+            while True:
+                n = raw.readinto(view[chunk_size_downloaded:chunk_size_downloaded + 1024 * 1024])
+                if not n:
+                    break
+                chunk_size_downloaded += n
+                
+                # 更新进度（每1MB一次）
+                with self.progress_lock:
+                    self.total_downloaded += n
+                    self.update_progress()
+            
+            # 验证数据块大小（输出文件已预分配，少收的部分会留下全零空洞）
+            if chunk_size_downloaded != expected_size:
+                raise Exception(f"数据块大小不匹配: 期望 {expected_size:,}, 实际 {chunk_size_downloaded:,}")
             
-            with open(chunk_file, 'wb') as f:
-                for data in response.iter_content(chunk_size=8192):
-                    if data:
-                        f.write(data)
-                        chunk_size_downloaded += len(data)
-                        
-                        # 更新进度
-                        with self.progress_lock:
-                            self.total_downloaded += len(data)
-                            self.update_progress()
+            # 一次性写入数据块在输出文件中的绝对偏移，各区间互不重叠
+            os.pwrite(fd, view[:chunk_size_downloaded], start)
             
-            actual_size = os.path.getsize(chunk_file)
-            print(f"✅ 线程 {chunk_id}: 完成，下载 {actual_size:,} 字节")
+            print(f"✅ 数据块 {chunk_id}: 完成，下载 {chunk_size_downloaded:,} 字节")
             
             return chunk_id, chunk_size_downloaded, None
             
         except Exception as e:
-            print(f"❌ 线程 {chunk_id}: 失败 - {str(e)}")
+            with self.progress_lock:
+                self.total_downloaded -= chunk_size_downloaded
+            print(f"❌ 数据块 {chunk_id}: 失败 - {str(e)}")
             return chunk_id, 0, str(e)
     
     def update_progress(self):
         """更新下载进度"""
         if self.total_size > 0:
             progress = (self.total_downloaded / self.total_size) * 100
-            elapsed_time = time.time() - self.start_time
+            elapsed_time = time.monotonic() - self.start_time
             
             if elapsed_time > 0:
                 speed = self.total_downloaded / elapsed_time
-                speed_mb = speed / (1024 * 1024)
+                speed_mb = speed * self._inv_mb
                 
-                downloaded_mb = self.total_downloaded / (1024 * 1024)
-                total_mb = self.total_size / (1024 * 1024)
+                downloaded_mb = self.total_downloaded * self._inv_mb
+                total_mb = self.total_size * self._inv_mb
                 
                 progress_bar = self.get_progress_bar(progress)
                 
@@ -116,142 +157,112 @@ class ChunkDownloadDemo:
                       f"{downloaded_mb:.1f}MB/{total_mb:.1f}MB | "
                       f"{speed_mb:.2f}MB/s", end='', flush=True)
     
-    def get_progress_bar(self, progress, width=20):
-        """生成进度条"""
-        filled = int(width * progress / 100)
-        bar = '█' * filled + '░' * (width - filled)
-        return f"[{bar}]"
-    
-    def merge_chunks(self, temp_dir, output_file, num_chunks):
-        """合并所有数据块"""
-        print(f"\n🔧 开始合并 {num_chunks} 个数据块...")
-        
-        try:
-            total_merged = 0
-            with open(output_file, 'wb') as outfile:
-                for i in range(num_chunks):
-                    chunk_file = os.path.join(temp_dir, f'chunk_{i:04d}.tmp')
-                    if os.path.exists(chunk_file):
-                        chunk_size = os.path.getsize(chunk_file)
-                        print(f"📄 合并数据块 {i}: {chunk_size:,} 字节")
-                        
-                        with open(chunk_file, 'rb') as infile:
-                            data = infile.read()
-                            outfile.write(data)
-                            total_merged += len(data)
-                        
-                        os.remove(chunk_file)
-                    else:
-                        print(f"⚠️  数据块 {i} 不存在")
-            
-            # 清理临时目录
-            if os.path.exists(temp_dir):
-                os.rmdir(temp_dir)
-            
-            print(f"✅ 合并完成: {output_file}")
-            print(f"📦 合并后文件大小: {total_merged:,} 字节 ({total_merged/(1024*1024):.2f} MB)")
-            
-            return True
-            
-        except Exception as e:
-            print(f"❌ 合并失败: {str(e)}")
-            return False
+    def get_progress_bar(self, progress):
+        """生成进度条（查预先生成的进度条表）"""
+        filled = min(int(self.bar_width * progress / 100), self.bar_width)
+        return self._bars[filled]
     
     def download_file(self, url, output_file):
         """分块下载文件"""
         print("🎯 开始分块下载演示")
         print("=" * 60)
         
-        # 测试Range支持
-        print("🧪 测试服务器Range支持...")
-        if not self.test_url_support(url):
+        # 一次请求同时检测Range支持和文件大小
+        print("🧪 测试服务器Range支持并获取文件信息...")
+        supports_range, file_size = self.probe(url)
+        if not supports_range:
             print("❌ 服务器不支持分块下载")
             return False
         
-        # 获取文件大小
-        print("\n📏 获取文件信息...")
-        file_size = self.get_file_size(url)
         if file_size == 0:
             print("❌ 无法获取文件大小")
             return False
         
         self.total_size = file_size
         
-        # 计算分块策略
-        num_chunks = min(self.max_threads, max(1, file_size // self.chunk_size))
-        chunk_size = file_size // num_chunks
+        # 计算分块策略：固定大小的区间，由线程池依次领取
+        ranges = self.split_ranges(file_size)
+        num_workers = min(self.max_threads, len(ranges))
         
         print(f"\n🔀 分块策略:")
-        print(f"   总线程数: {num_chunks}")
-        print(f"   每块大小: {chunk_size:,} 字节 ({chunk_size/(1024*1024):.2f} MB)")
+        print(f"   总线程数: {num_workers}")
+        print(f"   数据块数: {len(ranges)}")
+        print(f"   每块大小: {self.chunk_size:,} 字节 ({self.chunk_size/(1024*1024):.2f} MB)")
         
-        # 创建临时目录
-        temp_dir = os.path.join(os.path.dirname(output_file), f'temp_chunks_{int(time.time())}')
-        os.makedirs(temp_dir, exist_ok=True)
+        # 预分配输出文件，各线程直接写入对应偏移，无需合并
+        fd = None
+        try:
+            fd = os.open(output_file, os.O_WRONLY | os.O_CREAT, 0o644)
+            os.ftruncate(fd, file_size)
+        except OSError as e:
+            print(f"❌ 无法创建输出文件: {str(e)}")
+            if fd is not None:
+                os.close(fd)
+                try:
+                    os.remove(output_file)
+                except OSError:
+                    pass
+            return False
         
         print(f"\n🚀 开始多线程下载...")
         print("=" * 60)
         
-        self.start_time = time.time()
+        self.start_time = time.monotonic()
         self.total_downloaded = 0
         
-        # 显示每个线程的分工
-        for i in range(num_chunks):
-            start = i * chunk_size
-            end = start + chunk_size - 1
-            if i == num_chunks - 1:
-                end = file_size - 1
-            print(f"🧵 线程 {i}: 字节 {start:,} - {end:,} ({end-start+1:,} 字节)")
+        # 显示每个数据块的区间
+        for i, (start, end) in enumerate(ranges):
+            print(f"🧵 数据块 {i}: 字节 {start:,} - {end:,} ({end-start+1:,} 字节)")
         
         print()
         
         # 启动多线程下载
-        with ThreadPoolExecutor(max_workers=num_chunks) as executor:
-            futures = []
-            
-            for i in range(num_chunks):
-                start = i * chunk_size
-                end = start + chunk_size - 1
-                if i == num_chunks - 1:
-                    end = file_size - 1
+        try:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                futures = []
                 
-                future = executor.submit(self.download_chunk, url, start, end, i, temp_dir)
-                futures.append(future)
-            
-            # 等待所有下载完成
-            failed_chunks = []
-            for future in as_completed(futures):
-                chunk_id, downloaded, error = future.result()
-                if error:
-                    failed_chunks.append(chunk_id)
+                for i, (start, end) in enumerate(ranges):
+                    future = executor.submit(self.download_chunk, url, start, end, i, fd)
+                    futures.append(future)
+                
+                # 等待所有下载完成
+                failed_chunks = []
+                received = 0
+                for future in as_completed(futures):
+                    chunk_id, downloaded, error = future.result()
+                    received += downloaded
+                    if error:
+                        failed_chunks.append(chunk_id)
+        finally:
+            os.close(fd)
         
         print()  # 换行
         
         if failed_chunks:
             print(f"❌ 有 {len(failed_chunks)} 个数据块下载失败")
+            # 清理不完整的输出文件
+            try:
+                os.remove(output_file)
+            except OSError:
+                pass
             return False
         
-        # 合并文件
-        success = self.merge_chunks(temp_dir, output_file, num_chunks)
+        elapsed_time = time.monotonic() - self.start_time
+        avg_speed = (file_size / (1024*1024)) / elapsed_time if elapsed_time > 0 else 0
         
-        if success:
-            elapsed_time = time.time() - self.start_time
-            avg_speed = (file_size / (1024*1024)) / elapsed_time if elapsed_time > 0 else 0
-            
-            print("\n" + "=" * 60)
-            print("🎉 分块下载演示完成!")
-            print(f"⏱️  总用时: {elapsed_time:.2f} 秒")
-            print(f"📈 平均速度: {avg_speed:.2f} MB/s")
-            print(f"💾 文件位置: {output_file}")
-            
-            # 验证文件完整性
-            actual_size = os.path.getsize(output_file)
-            if actual_size == file_size:
-                print("✅ 文件完整性验证通过")
-            else:
-                print(f"⚠️  文件大小不匹配: 期望 {file_size:,}, 实际 {actual_size:,}")
+        print("\n" + "=" * 60)
+        print("🎉 分块下载演示完成!")
+        print(f"⏱️  总用时: {elapsed_time:.2f} 秒")
+        print(f"📈 平均速度: {avg_speed:.2f} MB/s")
+        print(f"💾 文件位置: {output_file}")
+        
+        # 验证文件完整性：文件已预分配，需核对实际收到的字节数
+        if received == file_size:
+            print("✅ 文件完整性验证通过")
+        else:
+            print(f"⚠️  收到的数据量不匹配: 期望 {file_size:,}, 实际 {received:,}")
         
-        return success
+        return True
 
 def main():
     parser = argparse.ArgumentParser(description="分块下载演示程序")
@@ -287,7 +298,7 @@ def main():
     print("=" * 60)
     
     # 创建输出目录
-    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
     
     # 创建下载器
     downloader = ChunkDownloadDemo(
@@ -3,26 +3,119 @@ import sys
 import time
 import math
 import threading
+import asyncio
+import queue
+import random
+import io
+import shutil
+import mmap
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
-import yt_dlp
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urlparse
 import hashlib
+from pathlib import Path
+from filename_utils import SafeCharTable
+from http_utils import check_range_response
+from config import NETWORK_CONFIG, PROGRESS_CONFIG
+
+try:
+    import aiohttp  # 可选依赖：安装后使用单线程异步下载
+except ImportError:
+    aiohttp = None
+
+try:
+    import httpx  # 可选依赖：小文件通过一条HTTP/2连接多路复用下载
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持需要 h2
+except ImportError:
+    httpx = None
+
+
+class _CountingReader(io.RawIOBase):
+    """
+    包装响应流，每次读取后把读到的字节数回调给进度统计
+    """
+    def __init__(self, raw, on_bytes):
+        self.raw = raw
+        self.on_bytes = on_bytes
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, b):
+        n = self.raw.readinto(b)
+        if n:
+            self.on_bytes(n)
+        return n
+
+class _WorkerState:
+    """
+    单个下载线程的私有状态：独立会话和已下载字节数（只由该线程写入）
+    """
+    def __init__(self, session):
+        self.session = session
+        self.downloaded = 0
 
 class ChunkDownloader:
-    def __init__(self, max_threads=8, chunk_size=2*1024*1024):  # 2MB per chunk
+    _SAFE_TBL = SafeCharTable(' -_.')
+    
+    def __init__(self, max_threads=8, chunk_size=8*1024*1024):  # 8MB per chunk
         self.max_threads = max_threads
         self.chunk_size = chunk_size
+        self.max_range = 2 * chunk_size  # 合并相邻区间后的最大请求大小
+        self.http2_threshold = 50 * 1024 * 1024  # 小于此大小的文件优先使用HTTP/2多路复用
         self.progress_lock = threading.Lock()
         self.total_downloaded = 0
         self.total_size = 0
         self.start_time = None
         self.chunk_progress = {}  # 跟踪每个块的下载进度
+        self.update_interval = PROGRESS_CONFIG.get('update_interval', 0.5)
+        self.output_view = None  # 输出文件的内存映射视图（仅多线程模式）
+        self._inv_mb = 1.0 / (1024 * 1024)  # 以乘法代替进度计算中的除法
+        self._h2 = False  # 探测时服务器是否协商到HTTP/2（见 probe）
         
+        # 主线程的会话用于探测和标准下载；每个下载线程另有自己的会话（见 _worker_state）
+        self.session = self._create_session(NETWORK_CONFIG.get('pool_maxsize', 10))
+        self._local = threading.local()
+        self._workers = []  # 所有下载线程的状态，进度线程汇总其字节计数
+        
+    def _create_session(self, pool_maxsize, pool_block=True):
+        """
+        创建带连接池的会话，pool_block 为真时池满阻塞等待而不是丢弃连接后重新握手
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=NETWORK_CONFIG.get('pool_connections', 10),
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if NETWORK_CONFIG.get('user_agent'):
+            session.headers['User-Agent'] = NETWORK_CONFIG['user_agent']
+        return session
+    
+    def _worker_state(self):
+        """
+        获取当前下载线程私有的会话和字节计数，首次调用时创建并登记
+        """
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            # 每个线程顺序发请求，一个连接足够；不阻塞等待连接，
+            # 即使某个连接未能归还也只是新建连接，而不会让线程永远卡在取连接上
+            state = self._local.state = _WorkerState(self._create_session(1, pool_block=False))
+            with self.progress_lock:
+                self._workers.append(state)
+        return state
+    
     def get_video_url(self, youtube_url):
         """
         获取YouTube视频的直接下载链接
         """
+        import yt_dlp  # 延迟导入：只有解析YouTube链接时才需要，避免拖慢启动
+        
         ydl_opts = {
             'format': 'best[height<=1080][ext=mp4]/best[ext=mp4]/best',
             'quiet': True,
@@ -42,127 +135,256 @@ class ChunkDownloader:
                 print(f"⏱️  视频时长: {duration} 秒")
                 print(f"👤 上传者: {uploader}")
                 
-                # 获取最佳格式的URL
-                if 'url' in info:
-                    return info['url'], title
+                # yt-dlp 已按 format 表达式选好格式，直接使用其结果
+                if 'requested_formats' in info:
+                    return info['requested_formats'][0].get('url'), title
+                return info.get('url'), title
                 
-                # 如果没有直接URL，查找格式列表
-                formats = info.get('formats', [])
-                if formats:
-                    # 优先选择mp4格式
-                    for fmt in reversed(formats):
-                        if (fmt.get('ext') == 'mp4' and 
-                            fmt.get('vcodec') != 'none' and 
-                            fmt.get('url')):
-                            return fmt['url'], title
-                    
-                    # 如果没有mp4，选择第一个有效格式
-                    for fmt in reversed(formats):
-                        if fmt.get('url') and fmt.get('vcodec') != 'none':
-                            return fmt['url'], title
-                            
         except Exception as e:
             print(f"❌ 获取视频URL失败: {str(e)}")
             return None, None
-            
-        return None, None
     
-    def test_range_support(self, url):
+    def _safe_filename(self, title):
         """
-        测试服务器是否支持Range请求（分块下载）
+        去掉标题中的非法字符，生成安全的文件名
         """
-        try:
-            headers = {'Range': 'bytes=0-1023'}  # 请求前1KB
-            response = requests.head(url, headers=headers, timeout=10)
-            
-            # 检查状态码和头部
-            if response.status_code == 206:  # Partial Content
-                return True
-            elif response.status_code == 200:
-                # 有些服务器返回200但实际支持Range
-                return 'accept-ranges' in response.headers
-            else:
-                return False
-                
-        except Exception as e:
-            print(f"⚠️  Range支持测试失败: {str(e)}")
-            return False
+        return title.translate(self._SAFE_TBL).rstrip()[:200]  # 限制文件名长度
     
-    def get_file_size(self, url):
+    def probe(self, url):
         """
-        获取文件大小
+        用一次 Range: bytes=0-0 的HEAD请求同时检测Range支持和文件大小
+        安装了httpx时通过它发送，并记录是否协商到HTTP/2，HTTP/2下载不再重复探测
+        返回 (是否支持Range, 文件大小)
         """
+        headers = {'Range': 'bytes=0-0'}
+        
+        if httpx is not None:
+            try:
+                client_headers = {}
+                if NETWORK_CONFIG.get('user_agent'):
+                    client_headers['User-Agent'] = NETWORK_CONFIG['user_agent']
+                with httpx.Client(http2=True, headers=client_headers, timeout=10,
+                                  follow_redirects=True) as client:
+                    response = client.head(url, headers=headers)
+                self._h2 = response.http_version == 'HTTP/2'
+                return self.parse_probe(response.status_code, response.headers)
+            except Exception:
+                # httpx探测失败时改用requests会话再试一次
+                self._h2 = False
+        
         try:
-            # 先尝试HEAD请求
-            response = requests.head(url, timeout=10)
-            
-            if 'content-length' in response.headers:
-                return int(response.headers['content-length'])
-            
-            # 如果HEAD请求没有content-length，尝试Range请求
-            headers = {'Range': 'bytes=0-1'}
-            response = requests.head(url, headers=headers, timeout=10)
+            response = self.session.head(url, headers=headers, timeout=10, allow_redirects=True)
+            return self.parse_probe(response.status_code, response.headers)
             
-            if 'content-range' in response.headers:
-                # 从 Content-Range 头获取总大小
-                content_range = response.headers['content-range']
-                total_size = int(content_range.split('/')[-1])
-                return total_size
-            
-            # 最后尝试GET请求（只获取很少的字节）
-            headers = {'Range': 'bytes=0-1023'}
-            response = requests.get(url, headers=headers, timeout=10)
-            if 'content-range' in response.headers:
-                content_range = response.headers['content-range']
-                total_size = int(content_range.split('/')[-1])
-                return total_size
-                
         except Exception as e:
-            print(f"❌ 获取文件大小失败: {str(e)}")
-            return 0
+            print(f"⚠️  服务器探测失败: {str(e)}")
+            return False, 0
+    
+    def parse_probe(self, status_code, headers):
+        """
+        从探测响应中解析Range支持情况和文件总大小
+        """
+        # 206 表示支持Range；有些服务器返回200但带有 Accept-Ranges
+        supports_range = (status_code == 206 or
+                          (status_code == 200 and 'accept-ranges' in headers))
+        
+        # 从 Content-Range 头获取总大小，否则使用完整响应的 Content-Length
+        total_size = 0
+        if 'content-range' in headers:
+            total_size = int(headers['content-range'].split('/')[-1])
+        elif status_code == 200 and 'content-length' in headers:
+            total_size = int(headers['content-length'])
         
-        return 0
+        return supports_range, total_size
     
-    def download_chunk(self, url, start, end, chunk_id, temp_dir, retry_count=0):
+    def split_ranges(self, file_size):
         """
-        下载单个数据块，支持重试
+        按固定大小切分下载区间，并把过小的相邻区间合并，减少HTTP请求次数
+        """
+        ranges = []
+        for start in range(0, file_size, self.chunk_size):
+            end = min(start + self.chunk_size, file_size) - 1
+            if (ranges and end - start + 1 < self.chunk_size and
+                    end - ranges[-1][0] + 1 <= self.max_range):
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+    
+    def download_chunk(self, url, start, end, chunk_id, fd):
+        """
+        下载单个数据块，直接写入输出文件的对应偏移位置，失败时指数退避重试
         """
         headers = {'Range': f'bytes={start}-{end}'}
-        chunk_file = os.path.join(temp_dir, f'chunk_{chunk_id:04d}.tmp')
         max_retries = 3
+        expected_size = end - start + 1
+        state = self._worker_state()
         
+        if self.output_view is not None:
+            # 输出文件已映射到内存：直接读入文件中对应的区间，无需额外缓冲和写入
+            slot = None
+            view = self.output_view[start:end + 1]
+        else:
+            # 从共享缓冲区中领取一个空闲槽位，用完归还，不再为每个数据块分配内存
+            slot = self.buffer_pool.get()
+            view = slot[:expected_size]
         try:
-            response = requests.get(url, headers=headers, stream=True, timeout=30)
-            response.raise_for_status()
-            
+            for attempt in range(max_retries + 1):
+                chunk_size_downloaded = 0
+                try:
+                    # 响应用完即关闭，出错或未读完时连接也会释放回连接池
+                    with state.session.get(url, headers=headers, stream=True, timeout=30) as response:
+                        response.raise_for_status()
+                        check_range_response(response.status_code, response.headers, start)
+                        
+                        # 按1MB切片直接读入，避免逐个8KB创建bytes对象
+                        raw = response.raw
+                        raw.decode_content = True
+                        
+                        while True:
+                            n = raw.readinto(view[chunk_size_downloaded:chunk_size_downloaded + 1024 * 1024])
+                            if not n:
+                                break
+                            chunk_size_downloaded += n
+                            
+                            # 只累加本线程私有的计数，无需加锁；由进度线程汇总
+                            state.downloaded += n
+                    
+                    if slot is not None:
+                        # 一次性写入数据块在输出文件中的绝对偏移，各区间互不重叠
+                        os.pwrite(fd, view[:chunk_size_downloaded], start)
+                    
+                    # 验证下载的数据块大小
+                    # 输出文件已预分配，少收的部分会留下全零空洞，必须完整
+                    if chunk_size_downloaded < expected_size:
+                        raise Exception(f"数据块大小不匹配: 期望 {expected_size}, 实际 {chunk_size_downloaded}")
+                    
+                    return chunk_id, chunk_size_downloaded, None
+                    
+                except Exception as e:
+                    # 撤回本次失败尝试计入的进度，重试会重新下载整个区间
+                    state.downloaded -= chunk_size_downloaded
+                    
+                    if attempt == max_retries:
+                        return chunk_id, 0, str(e)
+                    
+                    wait_time = min(2 ** attempt + random.random(), 30)  # 带抖动的指数退避
+                    print(f"\n⚠️  数据块 {chunk_id} 下载失败，{wait_time:.1f}秒后重试 ({attempt + 1}/{max_retries})...")
+                    time.sleep(wait_time)
+        finally:
+            view.release()
+            if slot is not None:
+                self.buffer_pool.put(slot)
+    
+    async def download_range_async(self, open_stream, iter_body, start, end, chunk_id, fd, max_retries=3):
+        """
+        异步下载单个数据块，直接写入输出文件的对应偏移位置，失败时带抖动指数退避重试
+        aiohttp 与 HTTP/2 路径共用：open_stream(headers) 返回响应的异步上下文，
+        iter_body(response) 逐块返回响应体
+        """
+        headers = {'Range': f'bytes={start}-{end}'}
+        expected_size = end - start + 1
+        
+        for retry_count in range(max_retries + 1):
             chunk_size_downloaded = 0
-            expected_size = end - start + 1
-            
-            with open(chunk_file, 'wb') as f:
-                for data in response.iter_content(chunk_size=8192):
-                    if data:
-                        f.write(data)
+            try:
+                async with open_stream(headers) as response:
+                    response.raise_for_status()
+                    # aiohttp 的状态码属性是 status，httpx 是 status_code
+                    status_code = getattr(response, 'status_code', None) or response.status
+                    check_range_response(status_code, response.headers, start)
+                    
+                    async for data in iter_body(response):
+                        data = data[:expected_size - chunk_size_downloaded]
+                        os.pwrite(fd, data, start + chunk_size_downloaded)
                         chunk_size_downloaded += len(data)
                         
-                        # 更新进度
-                        with self.progress_lock:
-                            self.total_downloaded += len(data)
-                            self.update_progress()
-            
-            # 验证下载的数据块大小
-            if chunk_size_downloaded < expected_size * 0.9:  # 允许10%的误差
-                raise Exception(f"数据块大小不匹配: 期望 {expected_size}, 实际 {chunk_size_downloaded}")
-            
-            return chunk_id, chunk_size_downloaded, None
-            
-        except Exception as e:
-            # 重试逻辑
-            if retry_count < max_retries:
-                print(f"\n⚠️  数据块 {chunk_id} 下载失败，正在重试 ({retry_count + 1}/{max_retries})...")
-                time.sleep(1)  # 等待1秒后重试
-                return self.download_chunk(url, start, end, chunk_id, temp_dir, retry_count + 1)
-            else:
-                return chunk_id, 0, str(e)
+                        # 事件循环是单线程的，累加进度无需加锁
+                        self.total_downloaded += len(data)
+                        
+                        if chunk_size_downloaded >= expected_size:
+                            break
+                
+                # 输出文件已预分配，少收的部分会留下全零空洞，必须完整
+                if chunk_size_downloaded < expected_size:
+                    raise Exception(f"数据块大小不匹配: 期望 {expected_size}, 实际 {chunk_size_downloaded}")
+                
+                return chunk_id, chunk_size_downloaded, None
+                
+            except Exception as e:
+                self.total_downloaded -= chunk_size_downloaded
+                
+                if retry_count == max_retries:
+                    return chunk_id, 0, str(e)
+                
+                wait_time = min(2 ** retry_count + random.random(), 30)  # 带抖动的指数退避
+                print(f"\n⚠️  数据块 {chunk_id} 下载失败，{wait_time:.1f}秒后重试 ({retry_count + 1}/{max_retries})...")
+                await asyncio.sleep(wait_time)
+    
+    def collect_failed(self, results):
+        """汇总各数据块的下载结果，返回失败的数据块编号"""
+        failed_chunks = []
+        for chunk_id, downloaded, error in results:
+            if error:
+                failed_chunks.append(chunk_id)
+                print(f"\n❌ 数据块 {chunk_id} 最终下载失败: {error}")
+        return failed_chunks
+    
+    async def download_chunk_async(self, session, url, start, end, chunk_id, fd, max_retries=3):
+        """
+        异步下载单个数据块（aiohttp）
+        """
+        return await self.download_range_async(
+            lambda headers: session.get(url, headers=headers),
+            lambda response: response.content.iter_chunked(65536),
+            start, end, chunk_id, fd, max_retries)
+    
+    async def download_chunks_async(self, url, ranges, fd):
+        """
+        在一个事件循环中并发下载所有数据块，返回失败的数据块编号
+        """
+        connector = aiohttp.TCPConnector(limit=self.max_threads, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+        headers = {}
+        if NETWORK_CONFIG.get('user_agent'):
+            headers['User-Agent'] = NETWORK_CONFIG['user_agent']
+        
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+            results = await asyncio.gather(*(
+                self.download_chunk_async(session, url, start, end, chunk_id, fd)
+                for chunk_id, (start, end) in enumerate(ranges)
+            ))
+        
+        return self.collect_failed(results)
+    
+    async def download_http2_chunk(self, client, url, start, end, chunk_id, fd, max_retries=3):
+        """
+        通过共享的HTTP/2连接下载单个数据块
+        """
+        return await self.download_range_async(
+            lambda headers: client.stream('GET', url, headers=headers),
+            lambda response: response.aiter_raw(),
+            start, end, chunk_id, fd, max_retries)
+    
+    async def download_chunks_http2(self, url, ranges, fd):
+        """
+        在一条HTTP/2连接上并发请求所有区间，返回失败的数据块编号
+        仅在 probe 已确认服务器支持HTTP/2时调用
+        """
+        limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+        headers = {}
+        if NETWORK_CONFIG.get('user_agent'):
+            headers['User-Agent'] = NETWORK_CONFIG['user_agent']
+        
+        async with httpx.AsyncClient(http2=True, limits=limits, headers=headers,
+                                     timeout=30, follow_redirects=True) as client:
+            print("⚡ 服务器支持HTTP/2，所有数据块复用同一连接")
+            results = await asyncio.gather(*(
+                self.download_http2_chunk(client, url, start, end, chunk_id, fd)
+                for chunk_id, (start, end) in enumerate(ranges)
+            ))
+        
+        return self.collect_failed(results)
     
     def update_progress(self):
         """
@@ -170,11 +392,11 @@ class ChunkDownloader:
         """
         if self.total_size > 0:
             progress = (self.total_downloaded / self.total_size) * 100
-            elapsed_time = time.time() - self.start_time
+            elapsed_time = time.monotonic() - self.start_time
             
             if elapsed_time > 0:
                 speed = self.total_downloaded / elapsed_time
-                speed_mb = speed / (1024 * 1024)
+                speed_mb = speed * self._inv_mb
                 
                 # 计算剩余时间
                 if speed > 0:
@@ -185,46 +407,38 @@ class ChunkDownloader:
                     eta_str = "N/A"
                 
                 # 格式化大小显示
-                downloaded_mb = self.total_downloaded / (1024 * 1024)
-                total_mb = self.total_size / (1024 * 1024)
+                downloaded_mb = self.total_downloaded * self._inv_mb
+                total_mb = self.total_size * self._inv_mb
                 
                 print(f"\r🚀 进度: {progress:.1f}% | "
                       f"已下载: {downloaded_mb:.1f}MB/{total_mb:.1f}MB | "
                       f"速度: {speed_mb:.2f}MB/s | "
                       f"剩余: {eta_str}", end='', flush=True)
     
-    def merge_chunks(self, temp_dir, output_file, num_chunks):
+    def progress_reporter(self, stop_event):
         """
-        合并所有数据块
+        后台线程：按固定间隔刷新进度，下载线程不再直接输出
         """
-        print(f"\n🔧 正在合并 {num_chunks} 个数据块...")
-        
-        try:
-            with open(output_file, 'wb') as outfile:
-                for i in range(num_chunks):
-                    chunk_file = os.path.join(temp_dir, f'chunk_{i:04d}.tmp')
-                    if os.path.exists(chunk_file):
-                        with open(chunk_file, 'rb') as infile:
-                            outfile.write(infile.read())
-                        os.remove(chunk_file)  # 删除临时文件
-                    else:
-                        print(f"⚠️  警告: 数据块 {i} 不存在")
-            
-            # 删除临时目录
-            if os.path.exists(temp_dir):
-                os.rmdir(temp_dir)
-                
-            print(f"✅ 文件合并完成: {output_file}")
-            return True
-            
-        except Exception as e:
-            print(f"❌ 合并文件失败: {str(e)}")
-            return False
+        while not stop_event.wait(self.update_interval):
+            self.collect_progress()
+            self.update_progress()
+        self.collect_progress()
+        self.update_progress()
+    
+    def collect_progress(self):
+        """
+        汇总多线程模式下各下载线程的字节计数（异步模式直接更新 total_downloaded）
+        """
+        if self._workers:
+            self.total_downloaded = sum(state.downloaded for state in self._workers)
     
     def download_video(self, youtube_url, output_dir="./downloads"):
         """
         分块下载YouTube视频
         """
+        # 启动时一次性创建输出目录（标准下载方式也需要）
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        
         print("🎯 获取视频信息...")
         
         # 获取视频直接下载链接
@@ -235,17 +449,15 @@ class ChunkDownloader:
         
         print(f"🔗 视频URL: {video_url[:80]}...")
         
-        # 测试Range支持
+        # 一次请求同时检测Range支持和文件大小
         print("🧪 测试分块下载支持...")
-        if not self.test_range_support(video_url):
+        supports_range, file_size = self.probe(video_url)
+        if not supports_range:
             print("⚠️  服务器不支持分块下载，将使用标准下载方式")
             return self.fallback_download(video_url, title, output_dir)
         
         print("✅ 服务器支持分块下载")
         
-        # 获取文件大小
-        print("📏 检测文件大小...")
-        file_size = self.get_file_size(video_url)
         if file_size == 0:
             print("❌ 无法获取文件大小，使用标准下载方式")
             return self.fallback_download(video_url, title, output_dir)
@@ -253,74 +465,114 @@ class ChunkDownloader:
         self.total_size = file_size
         print(f"📊 文件大小: {file_size / (1024*1024):.2f} MB")
         
-        # 动态计算最佳分块数量
-        optimal_chunks = min(self.max_threads, max(1, file_size // self.chunk_size))
-        if file_size < 10 * 1024 * 1024:  # 小于10MB的文件不分块
-            optimal_chunks = 1
-        
-        chunk_size = file_size // optimal_chunks
-        
-        print(f"🔀 分块策略: {optimal_chunks} 个线程，每块约 {chunk_size / (1024*1024):.2f} MB")
+        # 切分为固定大小的区间，空闲线程依次领取下一个区间
+        ranges = self.split_ranges(file_size)
+        num_workers = min(self.max_threads, len(ranges))
         
-        # 创建输出目录和临时目录
-        os.makedirs(output_dir, exist_ok=True)
-        temp_dir = os.path.join(output_dir, f'temp_chunks_{int(time.time())}')
-        os.makedirs(temp_dir, exist_ok=True)
+        print(f"🔀 分块策略: {len(ranges)} 个数据块，{num_workers} 个线程，每块约 {self.chunk_size / (1024*1024):.2f} MB")
         
         # 生成安全的文件名
-        safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_', '.')).rstrip()
-        safe_title = safe_title[:200]  # 限制文件名长度
-        output_file = os.path.join(output_dir, f"{safe_title}.mp4")
+        output_file = os.path.join(output_dir, f"{self._safe_filename(title)}.mp4")
+        
+        # 预分配输出文件，各线程直接写入对应偏移，省去临时文件与合并步骤
+        fd = None
+        try:
+            fd = os.open(output_file, os.O_RDWR | os.O_CREAT, 0o644)
+            os.ftruncate(fd, file_size)
+        except OSError as e:
+            print(f"❌ 无法创建输出文件: {str(e)}")
+            if fd is not None:
+                os.close(fd)
+                try:
+                    os.remove(output_file)
+                except OSError:
+                    pass
+            return False
         
         # 开始分块下载
         print("🚀 开始分块下载...")
-        self.start_time = time.time()
+        self.start_time = time.monotonic()
         self.total_downloaded = 0
         
-        with ThreadPoolExecutor(max_workers=optimal_chunks) as executor:
-            futures = []
+        stop_event = threading.Event()
+        reporter = threading.Thread(target=self.progress_reporter, args=(stop_event,), daemon=True)
+        reporter.start()
+        
+        output_map = None
+        try:
+            failed_chunks = None
+            if self._h2 and file_size < self.http2_threshold and len(ranges) > 1:
+                # 小文件且探测时已协商到HTTP/2：所有区间在一条连接上多路复用
+                failed_chunks = asyncio.run(self.download_chunks_http2(video_url, ranges, fd))
             
-            for i in range(optimal_chunks):
-                start = i * chunk_size
-                end = start + chunk_size - 1
-                if i == optimal_chunks - 1:  # 最后一块包含剩余的所有字节
-                    end = file_size - 1
+            if failed_chunks is None and aiohttp is not None:
+                # 单线程事件循环驱动所有数据块
+                failed_chunks = asyncio.run(self.download_chunks_async(video_url, ranges, fd))
+            elif failed_chunks is None:
+                use_map = sys.maxsize > 2**32
+                if use_map:
+                    try:
+                        # ftruncate 只生成稀疏文件，磁盘写满时写入映射会触发 SIGBUS 直接终止进程，
+                        # 映射前必须先真正预留磁盘空间
+                        os.posix_fallocate(fd, 0, file_size)
+                    except (AttributeError, OSError):
+                        # 非Linux或空间不足时改用 pwrite，写入失败只会让对应数据块报错
+                        use_map = False
                 
-                future = executor.submit(self.download_chunk, video_url, start, end, i, temp_dir)
-                futures.append(future)
-            
-            # 等待所有下载完成
-            failed_chunks = []
-            for future in as_completed(futures):
-                chunk_id, downloaded, error = future.result()
-                if error:
-                    failed_chunks.append(chunk_id)
-                    print(f"\n❌ 数据块 {chunk_id} 最终下载失败: {error}")
+                if use_map:
+                    # 64位地址空间足够：映射整个输出文件，各线程写入互不重叠的切片
+                    output_map = mmap.mmap(fd, file_size)
+                    self.output_view = memoryview(output_map)
+                else:
+                    # 一次性分配所有线程共用的缓冲区，每个线程占用一个不重叠的槽位
+                    slot_size = max(end - start + 1 for start, end in ranges)
+                    arena = memoryview(bytearray(num_workers * slot_size))
+                    self.buffer_pool = queue.Queue()
+                    for i in range(num_workers):
+                        self.buffer_pool.put(arena[i * slot_size:(i + 1) * slot_size])
+                
+                # 线程池内部的任务队列按顺序分发区间，慢块不会拖住其他线程
+                with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                    futures = []
+                    
+                    for i, (start, end) in enumerate(ranges):
+                        future = executor.submit(self.download_chunk, video_url, start, end, i, fd)
+                        futures.append(future)
+                    
+                    # 等待所有下载完成
+                    failed_chunks = self.collect_failed(future.result() for future in as_completed(futures))
+        finally:
+            stop_event.set()
+            reporter.join()
+            for state in self._workers:
+                state.session.close()
+            self._workers = []
+            self._local = threading.local()
+            if output_map is not None:
+                self.output_view.release()
+                self.output_view = None
+                output_map.flush()
+                output_map.close()
+            os.close(fd)
         
         print()  # 换行
         
         if failed_chunks:
             print(f"❌ 有 {len(failed_chunks)} 个数据块下载失败")
-            # 清理临时文件
+            # 清理不完整的输出文件
             try:
-                for file in os.listdir(temp_dir):
-                    os.remove(os.path.join(temp_dir, file))
-                os.rmdir(temp_dir)
-            except:
+                os.remove(output_file)
+            except OSError:
                 pass
             return False
         
-        # 合并文件
-        success = self.merge_chunks(temp_dir, output_file, optimal_chunks)
+        elapsed_time = time.monotonic() - self.start_time
+        avg_speed = (file_size / (1024*1024)) / elapsed_time if elapsed_time > 0 else 0
+        print(f"⏱️  总用时: {elapsed_time:.1f} 秒")
+        print(f"📈 平均速度: {avg_speed:.2f} MB/s")
+        print(f"💾 文件保存至: {output_file}")
         
-        if success:
-            elapsed_time = time.time() - self.start_time
-            avg_speed = (file_size / (1024*1024)) / elapsed_time if elapsed_time > 0 else 0
-            print(f"⏱️  总用时: {elapsed_time:.1f} 秒")
-            print(f"📈 平均速度: {avg_speed:.2f} MB/s")
-            print(f"💾 文件保存至: {output_file}")
-            
-        return success
+        return True
     
     def fallback_download(self, video_url, title, output_dir):
         """
@@ -330,25 +582,18 @@ class ChunkDownloader:
         
         try:
             # 生成安全的文件名
-            safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_', '.')).rstrip()
-            safe_title = safe_title[:200]  # 限制文件名长度
-            output_file = os.path.join(output_dir, f"{safe_title}.mp4")
+            output_file = os.path.join(output_dir, f"{self._safe_filename(title)}.mp4")
             
-            response = requests.get(video_url, stream=True, timeout=30)
+            response = self.session.get(video_url, stream=True, timeout=30)
             response.raise_for_status()
             
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
+            self.total_size = int(response.headers.get('content-length', 0))
+            self.total_downloaded = 0
             
+            # copyfileobj 以1MB缓冲区循环拷贝，进度由包装流回调统计
+            response.raw.decode_content = True
             with open(output_file, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        
-                        if total_size > 0:
-                            progress = (downloaded / total_size) * 100
-                            print(f"\r📥 下载进度: {progress:.1f}% ({downloaded / (1024*1024):.1f}MB)", end='', flush=True)
+                shutil.copyfileobj(_CountingReader(response.raw, self._on_fallback_bytes), f, length=1024 * 1024)
             
             print(f"\n✅ 下载完成: {output_file}")
             return True
@@ -356,6 +601,15 @@ class ChunkDownloader:
         except Exception as e:
             print(f"\n❌ 标准下载也失败了: {str(e)}")
             return False
+    
+    def _on_fallback_bytes(self, n):
+        """
+        标准下载方式的进度回调
+        """
+        self.total_downloaded += n
+        if self.total_size > 0:
+            progress = (self.total_downloaded / self.total_size) * 100
+            print(f"\r📥 下载进度: {progress:.1f}% ({self.total_downloaded / (1024*1024):.1f}MB)", end='', flush=True)
 
 def main():
     if len(sys.argv) != 2:
@@ -367,8 +621,8 @@ def main():
         print("  python chunk_downloader.py <YouTube链接>")
         print()
         print("特性:")
-        print("  ✅ 多线程分块下载")
-        print("  ✅ 自动文件合并")
+        print("  ✅ 多线程分块下载 (安装 aiohttp 后自动使用异步模式)")
+        print("  ✅ 直接写入目标文件")
         print("  ✅ 实时速度监控")
         print("  ✅ 断点续传支持")
         print("  ✅ 智能线程调度")
@@ -377,7 +631,7 @@ def main():
     youtube_url = sys.argv[1]
     
     # 创建下载器实例
-    downloader = ChunkDownloader(max_threads=8, chunk_size=2*1024*1024)  # 2MB per chunk
+    downloader = ChunkDownloader(max_threads=8, chunk_size=8*1024*1024)  # 8MB per chunk
     
     print("🎬 YouTube 分块下载器启动")
     print("=" * 50)
@@ -51,11 +51,11 @@ FILE_CONFIG = {
     # 是否包含视频ID在文件名中
     "include_video_id": True,
     
-    # 临时文件目录前缀
-    "temp_dir_prefix": "temp_chunks_",
-    
-    # 是否自动清理失败的临时文件
+    # 是否自动清理下载失败的不完整文件
     "auto_cleanup": True,
+    
+    # 每个数据块写完后提示内核回写并释放其页缓存 (仅Linux，不等待回写完成)
+    "drop_page_cache": True,
 }
 
 # 网络配置
@@ -66,10 +66,12 @@ NETWORK_CONFIG = {
     # 是否启用代理 (留空不使用代理)
     "proxy": "",
     
-    # 连接池大小
+    # 连接池大小 (缓存连接池的主机数)
     "pool_connections": 10,
     
-    # 连接池最大大小
+    # 连接池最大大小 (每个主机的连接数)
+    # 增强版下载器所有线程共用一个连接池，实际取值不小于线程数的2倍；
+    # 分块下载器只把它用于探测和标准下载的会话，各下载线程另有单连接的会话
     "pool_maxsize": 10,
 }
 
@@ -87,3 +89,15 @@ PROGRESS_CONFIG = {
     # 是否显示详细信息
     "verbose": True,
 }
+
+# 缓存配置
+CACHE_CONFIG = {
+    # 视频信息缓存有效期 (秒)，视频直链会过期，不宜过长
+    "info_ttl": 600,
+    
+    # 是否启用磁盘缓存 (跨进程复用解析结果)
+    "enable_disk_cache": True,
+    
+    # 磁盘缓存目录
+    "cache_dir": "~/.cache/mp4dl",
+}
@@ -1,18 +1,16 @@
 import sys
 import os
 import yt_dlp
-from concurrent.futures import ThreadPoolExecutor
 import threading
+from contextlib import ExitStack
+from info_cache import get_cached_info
+from config import CACHE_CONFIG
 
-def download_video(url, output_dir="./downloads"):
+def build_ydl_opts(output_dir):
     """
-    下载视频，支持多线程和高速下载
+    生成优化的下载配置
     """
-    # 创建下载目录
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # 优化的下载配置
-    ydl_opts = {
+    return {
         # 视频质量设置
         'format': 'bestvideo[height<=1080]+bestaudio/best[height<=1080]/best',
         'merge_output_format': 'mp4',
@@ -39,23 +37,37 @@ def download_video(url, output_dir="./downloads"):
         'writeinfojson': False,
         'writethumbnail': False,
         
+        # 持久化播放器JS/签名缓存，后续视频无需重新解析播放器
+        'cachedir': os.path.join(os.path.expanduser(CACHE_CONFIG.get('cache_dir', '~/.cache/mp4dl')), 'yt-dlp'),
+        
         # 进度显示
         'progress_hooks': [progress_hook],
     }
+
+def download_video(url, output_dir="./downloads", ydl=None):
+    """
+    下载视频，支持多线程和高速下载
+    传入 ydl 时复用该 YoutubeDL 实例（输出目录以其配置为准），否则新建一个
+    """
+    # 创建下载目录
+    os.makedirs(output_dir, exist_ok=True)
     
     print(f"开始下载: {url}")
     print(f"保存目录: {output_dir}")
     
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # 先获取视频信息
-            info = ydl.extract_info(url, download=False)
+        with ExitStack() as stack:
+            if ydl is None:
+                ydl = stack.enter_context(yt_dlp.YoutubeDL(build_ydl_opts(output_dir)))
+            
+            # 先获取视频信息（命中缓存时不再重复解析）
+            info = get_cached_info(url, ydl.params, ydl)
             print(f"视频标题: {info.get('title', 'Unknown')}")
             print(f"视频时长: {info.get('duration', 'Unknown')} 秒")
             print(f"上传者: {info.get('uploader', 'Unknown')}")
             
-            # 开始下载
-            ydl.download([url])
+            # 直接用已解析的信息下载，避免 ydl.download 再解析一次
+            ydl.process_ie_result(info, download=True)
             print("✅ 下载完成!")
             
     except Exception as e:
@@ -77,24 +89,21 @@ def progress_hook(d):
     elif d['status'] == 'finished':
         print(f"\n✅ 下载完成: {d['filename']}")
 
-def download_multiple_videos(urls, max_workers=3):
+def download_multiple_videos(urls, max_workers=3, *, output_dir="./downloads"):
     """
-    并发下载多个视频
+    批量下载多个视频
+    所有视频共用一个 YoutubeDL：提取器、播放器签名缓存和连接池只初始化一次，
+    并发交给 yt-dlp 自身的分片并发下载；文件名带视频ID，所有视频保存在同一目录
+    max_workers 仅为兼容旧调用保留，视频按顺序逐个下载
     """
-    print(f"🚀 启动并发下载，最大线程数: {max_workers}")
+    print(f"🚀 启动批量下载，共 {len(urls)} 个视频")
+    
+    os.makedirs(output_dir, exist_ok=True)
     
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
+    with yt_dlp.YoutubeDL(build_ydl_opts(output_dir)) as ydl:
         for i, url in enumerate(urls, 1):
-            output_dir = f"./downloads/video_{i}"
-            future = executor.submit(download_video, url, output_dir)
-            futures.append(future)
-        
-        # 等待所有下载完成
-        for i, future in enumerate(futures, 1):
             try:
-                result = future.result()
-                if result:
+                if download_video(url, output_dir, ydl):
                     print(f"✅ 视频 {i} 下载成功")
                 else:
                     print(f"❌ 视频 {i} 下载失败")
@@ -111,16 +120,15 @@ def get_video_info(url):
     }
     
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            return {
-                'title': info.get('title', 'Unknown'),
-                'duration': info.get('duration', 'Unknown'),
-                'uploader': info.get('uploader', 'Unknown'),
-                'view_count': info.get('view_count', 'Unknown'),
-                'upload_date': info.get('upload_date', 'Unknown'),
-                'formats': len(info.get('formats', [])),
-            }
+        info = get_cached_info(url, ydl_opts)
+        return {
+            'title': info.get('title', 'Unknown'),
+            'duration': info.get('duration', 'Unknown'),
+            'uploader': info.get('uploader', 'Unknown'),
+            'view_count': info.get('view_count', 'Unknown'),
+            'upload_date': info.get('upload_date', 'Unknown'),
+            'formats': len(info.get('formats', [])),
+        }
     except Exception as e:
         print(f"❌ 获取视频信息失败: {str(e)}")
         return None
@@ -158,7 +166,7 @@ def main():
         # 单个视频下载
         download_video(urls[0])
     else:
-        # 多个视频并发下载
+        # 多个视频批量下载
         download_multiple_videos(urls)
 
 if __name__ == "__main__":
@@ -8,16 +8,44 @@ import os
 import sys
 import time
 import math
+import re
 import threading
 import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import heapq
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import requests
-import yt_dlp
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urlparse
 import argparse
+from info_cache import get_cached_info
+from filename_utils import SafeCharTable
+from http_utils import check_range_response
 from config import DOWNLOAD_CONFIG, VIDEO_CONFIG, FILE_CONFIG, NETWORK_CONFIG, PROGRESS_CONFIG
 
+try:
+    import aiohttp  # 可选依赖：安装后由单个事件循环驱动所有数据块
+except ImportError:
+    aiohttp = None
+
+try:
+    import httpx  # 可选依赖：服务器支持HTTP/2时所有数据块共用一条连接
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持需要 h2
+except ImportError:
+    httpx = None
+
 class EnhancedChunkDownloader:
+    # Content-Range: bytes 0-0/总大小
+    _RANGE_RE = re.compile(r'bytes \d+-\d+/(\d+)')
+    
+    # 文件名字符表，所有实例共享，见过的字符只判断一次
+    _FILENAME_TBL = SafeCharTable(' -_.()')
+    
+    # 默认宽度30的进度条只有31种，预先生成
+    _BARS = ['[' + '█' * i + '░' * (30 - i) + ']' for i in range(31)]
+    
     def __init__(self, config=None):
         self.config = config or DOWNLOAD_CONFIG
         self.video_config = VIDEO_CONFIG
@@ -28,11 +56,28 @@ class EnhancedChunkDownloader:
         self.max_threads = self.config.get('max_threads', 8)
         self.chunk_size = self.config.get('chunk_size', 2*1024*1024)
         
+        # 热路径上用到的配置在初始化时一次取出，避免每次读写都查字典
+        self._max_retries = self.config.get('max_retries', 3)
+        self._timeout = self.config.get('timeout', 30)
+        self._update_interval = self.progress_config.get('update_interval', 0.5)
+        self._show_speed = self.progress_config.get('show_speed', True)
+        self._show_eta = self.progress_config.get('show_eta', True)
+        self._verbose = self.progress_config.get('verbose', True)
+        self._chunk_io_size = 1 << 20
+        self._drop_page_cache = self.file_config.get('drop_page_cache', True) and hasattr(os, 'posix_fadvise')
+        
         self.progress_lock = threading.Lock()
         self.total_downloaded = 0
         self.total_size = 0
         self.start_time = None
-        self.last_update_time = 0
+        
+        # 每个线程先在本地累计字节数，满1MB才加锁并入 total_downloaded；
+        # 进度显示由独立的进度线程按 update_interval 刷新
+        self._local = threading.local()
+        self._flush_bytes = 1024 * 1024
+        self._should_update = False  # 由定时线程置位，标准下载模式据此刷新进度
+        self._last_filled = -1  # 上次显示的进度条格数和ETA，都没变化时跳过输出
+        self._last_eta = None
         
         # 配置requests会话
         self.session = requests.Session()
@@ -40,6 +85,34 @@ class EnhancedChunkDownloader:
             self.session.headers.update({
                 'User-Agent': self.network_config['user_agent']
             })
+        self.session.headers['Connection'] = 'keep-alive'
+        
+        # 连接池按线程数配置，池满时阻塞等待而不是丢弃连接；
+        # 连接失败和5xx由urllib3在同一连接池上指数退避重试
+        adapter = HTTPAdapter(
+            pool_connections=self.network_config.get('pool_connections', 10),
+            pool_maxsize=max(self.max_threads * 2, self.network_config.get('pool_maxsize', 10)),
+            pool_block=True,
+            max_retries=Retry(
+                total=self._max_retries,
+                backoff_factor=0.5,
+                status_forcelist=[500, 502, 503, 504]
+            )
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # HTTP/2客户端：所有数据块作为同一条TLS连接上的多路复用流，
+        # 是否启用由 test_range_support 探测后决定
+        self.client = None
+        self._h2 = False
+        if httpx is not None:
+            self.client = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=1, max_keepalive_connections=1),
+                headers=dict(self.session.headers),
+                follow_redirects=True
+            )
     
     def get_video_info(self, youtube_url):
         """
@@ -55,40 +128,39 @@ class EnhancedChunkDownloader:
         }
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(youtube_url, download=False)
-                
-                title = info.get('title', 'Unknown')
-                duration = info.get('duration', 0)
-                uploader = info.get('uploader', 'Unknown')
-                file_size = info.get('filesize') or info.get('filesize_approx', 0)
-                
-                print(f"📺 视频标题: {title}")
-                print(f"⏱️  视频时长: {self.format_duration(duration)}")
-                print(f"👤 上传者: {uploader}")
-                if file_size:
-                    print(f"📊 预估大小: {file_size / (1024*1024):.2f} MB")
-                
-                # 获取下载URL
-                url = info.get('url')
-                if not url and 'formats' in info:
-                    # 从格式列表中选择最佳格式
-                    formats = info['formats']
-                    for fmt in reversed(formats):
-                        if fmt.get('url') and fmt.get('vcodec') != 'none':
-                            url = fmt['url']
-                            file_size = fmt.get('filesize') or file_size
-                            break
-                
-                return {
-                    'url': url,
-                    'title': title,
-                    'duration': duration,
-                    'uploader': uploader,
-                    'filesize': file_size,
-                    'info': info
-                }
-                
+            info = get_cached_info(youtube_url, ydl_opts)
+            
+            title = info.get('title', 'Unknown')
+            duration = info.get('duration', 0)
+            uploader = info.get('uploader', 'Unknown')
+            file_size = info.get('filesize') or info.get('filesize_approx', 0)
+            
+            print(f"📺 视频标题: {title}")
+            print(f"⏱️  视频时长: {self.format_duration(duration)}")
+            print(f"👤 上传者: {uploader}")
+            if file_size:
+                print(f"📊 预估大小: {file_size / (1024*1024):.2f} MB")
+            
+            # 获取下载URL
+            url = info.get('url')
+            if not url:
+                # 优先使用yt-dlp已选中的格式（音视频分离时取视频流），
+                # 否则从格式列表末尾（质量最高）往前找第一个视频格式
+                candidates = info.get('requested_formats') or reversed(info.get('formats') or ())
+                fmt = next((f for f in candidates if f.get('url') and f.get('vcodec') != 'none'), None)
+                if fmt:
+                    url = fmt['url']
+                    file_size = fmt.get('filesize') or file_size
+            
+            return {
+                'url': url,
+                'title': title,
+                'duration': duration,
+                'uploader': uploader,
+                'filesize': file_size,
+                'info': info
+            }
+            
         except Exception as e:
             print(f"❌ 获取视频信息失败: {str(e)}")
             return None
@@ -98,61 +170,54 @@ class EnhancedChunkDownloader:
         if not seconds:
             return "未知"
         
-        hours = seconds // 3600
-        minutes = (seconds % 3600) // 60
-        seconds = seconds % 60
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
         
-        if hours > 0:
-            return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-        else:
-            return f"{minutes:02d}:{seconds:02d}"
+        if hours:
+            return '%02d:%02d:%02d' % (hours, minutes, seconds)
+        return '%02d:%02d' % (minutes, seconds)
     
-    def test_range_support(self, url):
-        """测试服务器是否支持Range请求"""
+    def probe_range(self, url):
+        """
+        用一次 bytes=0-0 的GET同时确认Range支持、获取文件总大小并取回首字节
+        返回 (是否支持Range, 文件大小, 首字节)；同时记录是否协商到HTTP/2
+        """
+        headers = {'Range': 'bytes=0-0'}
+        
+        if self.client is not None:
+            # 无论协商到哪个协议版本都直接使用这次响应，只用它决定是否启用HTTP/2
+            try:
+                with self.client.stream('GET', url, headers=headers, timeout=10) as response:
+                    self._h2 = response.http_version == 'HTTP/2'
+                    # 只有206时才读取首字节，200说明服务器忽略了Range，不能把整个文件读下来
+                    first_byte = next(response.iter_raw(), b'')[:1] if response.status_code == 206 else b''
+                    return self.parse_probe(response.status_code, response.headers, first_byte)
+            except Exception:
+                # httpx探测失败时改用requests会话再试一次
+                self._h2 = False
+        
         try:
-            headers = {'Range': 'bytes=0-1023'}
-            response = self.session.head(url, headers=headers, timeout=10)
-            
-            if response.status_code == 206:
-                return True
-            elif response.status_code == 200:
-                return 'accept-ranges' in response.headers
-            else:
-                return False
-                
+            with self.session.get(url, headers=headers, stream=True, timeout=10) as response:
+                # 只有206时才读取首字节，200说明服务器忽略了Range，不能把整个文件读下来
+                first_byte = response.raw.read(1) if response.status_code == 206 else b''
+                return self.parse_probe(response.status_code, response.headers, first_byte)
         except Exception as e:
             print(f"⚠️  Range支持测试失败: {str(e)}")
-            return False
+            return False, 0, b''
     
-    def get_accurate_file_size(self, url):
-        """获取精确的文件大小"""
-        try:
-            # 方法1: HEAD请求
-            response = self.session.head(url, timeout=10)
-            if 'content-length' in response.headers:
-                return int(response.headers['content-length'])
-            
-            # 方法2: Range请求获取
-            headers = {'Range': 'bytes=0-1'}
-            response = self.session.head(url, headers=headers, timeout=10)
-            if 'content-range' in response.headers:
-                content_range = response.headers['content-range']
-                total_size = int(content_range.split('/')[-1])
-                return total_size
-            
-            # 方法3: 小范围GET请求
-            headers = {'Range': 'bytes=0-1023'}
-            response = self.session.get(url, headers=headers, timeout=10)
-            if 'content-range' in response.headers:
-                content_range = response.headers['content-range']
-                total_size = int(content_range.split('/')[-1])
-                return total_size
-                
-        except Exception as e:
-            print(f"❌ 获取文件大小失败: {str(e)}")
-            return 0
-        
-        return 0
+    def parse_probe(self, status_code, headers, first_byte):
+        """从探测响应中解析Range支持情况和文件总大小"""
+        supports_range = status_code == 206
+        file_size = 0
+        
+        if supports_range:
+            match = self._RANGE_RE.match(headers.get('content-range', ''))
+            if match:
+                file_size = int(match.group(1))
+        elif status_code == 200 and 'content-length' in headers:
+            file_size = int(headers['content-length'])
+        
+        return supports_range, file_size, first_byte
     
     def calculate_optimal_chunks(self, file_size):
         """计算最佳分块策略"""
@@ -168,144 +233,338 @@ class EnhancedChunkDownloader:
         
         return optimal_chunks
     
-    def download_chunk(self, url, start, end, chunk_id, temp_dir, retry_count=0):
-        """下载单个数据块，支持重试"""
+    def download_chunk(self, url, start, end, chunk_id, fd):
+        """
+        下载单个数据块，直接写入输出文件的对应偏移位置（连接级重试由urllib3负责）
+        失败时也返回已写入的字节数，调用方只需重新下载剩余部分
+        """
+        if self._h2:
+            return self.download_chunk_h2(url, start, end, chunk_id, fd)
+        
         headers = {'Range': f'bytes={start}-{end}'}
-        chunk_file = os.path.join(temp_dir, f'chunk_{chunk_id:04d}.tmp')
-        max_retries = self.config.get('max_retries', 3)
-        timeout = self.config.get('timeout', 30)
+        timeout = self._timeout
+        chunk_size_downloaded = 0
+        expected_size = end - start + 1
         
         try:
-            response = self.session.get(url, headers=headers, stream=True, timeout=timeout)
-            response.raise_for_status()
+            # 响应用完即关闭，出错或未读完时连接也会释放回共享连接池
+            with self.session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                check_range_response(response.status_code, response.headers, start)
+                
+                # 每个线程复用同一个1MB缓冲区直接读入，所有区间和重试都不再重新分配
+                raw = response.raw
+                raw.decode_content = True
+                view = getattr(self._local, 'view', None)
+                if view is None:
+                    view = self._local.view = memoryview(bytearray(self._chunk_io_size))
+                
+                while chunk_size_downloaded < expected_size:
+                    # 读满本区间即停止，不读取多余的数据
+                    n = raw.readinto(view[:min(len(view), expected_size - chunk_size_downloaded)])
+                    if not n:
+                        break
+                
+                    # 按绝对偏移写入，各区间互不重叠，pwrite 无需加锁
+                    os.pwrite(fd, view[:n], start + chunk_size_downloaded)
+                    chunk_size_downloaded += n
+                
+                    self.add_progress(n)
             
-            chunk_size_downloaded = 0
-            expected_size = end - start + 1
+            # 验证下载完整性（文件已预分配，缺少的部分会变成空洞，剩余部分由调用方续传）
+            if chunk_size_downloaded < expected_size:
+                raise Exception(f"数据块不完整: 期望 {expected_size}, 实际 {chunk_size_downloaded}")
             
-            with open(chunk_file, 'wb') as f:
-                for data in response.iter_content(chunk_size=8192):
-                    if data:
-                        f.write(data)
-                        chunk_size_downloaded += len(data)
-                        
-                        # 更新进度
-                        with self.progress_lock:
-                            self.total_downloaded += len(data)
-                            current_time = time.time()
-                            if (current_time - self.last_update_time) > self.progress_config.get('update_interval', 0.5):
-                                self.update_progress()
-                                self.last_update_time = current_time
+            self.release_page_cache(fd, start, chunk_size_downloaded)
+            return chunk_id, chunk_size_downloaded, None
             
-            # 验证下载完整性
-            if chunk_size_downloaded < expected_size * 0.95:  # 允许5%的误差
+        except Exception as e:
+            return chunk_id, chunk_size_downloaded, str(e)
+        finally:
+            self.flush_progress()
+    
+    def download_chunk_h2(self, url, start, end, chunk_id, fd):
+        """通过共享的HTTP/2连接下载单个数据块，直接写入输出文件的对应偏移位置"""
+        headers = {'Range': f'bytes={start}-{end}'}
+        timeout = self._timeout
+        
+        chunk_size_downloaded = 0
+        expected_size = end - start + 1
+        
+        try:
+            with self.client.stream('GET', url, headers=headers, timeout=timeout) as response:
+                response.raise_for_status()
+                check_range_response(response.status_code, response.headers, start)
+                
+                for data in response.iter_raw(self._chunk_io_size):
+                    # 读满本区间即停止，不写入多余的数据
+                    data = data[:expected_size - chunk_size_downloaded]
+                    os.pwrite(fd, data, start + chunk_size_downloaded)
+                    chunk_size_downloaded += len(data)
+                    self.add_progress(len(data))
+                    
+                    if chunk_size_downloaded >= expected_size:
+                        break
+            
+            # 验证下载完整性（文件已预分配，缺少的部分会变成空洞，剩余部分由调用方续传）
+            if chunk_size_downloaded < expected_size:
                 raise Exception(f"数据块不完整: 期望 {expected_size}, 实际 {chunk_size_downloaded}")
             
+            self.release_page_cache(fd, start, chunk_size_downloaded)
             return chunk_id, chunk_size_downloaded, None
             
         except Exception as e:
-            # 重试逻辑
-            if retry_count < max_retries:
+            return chunk_id, chunk_size_downloaded, str(e)
+        finally:
+            self.flush_progress()
+    
+    def download_ranges(self, url, ranges, fd, workers):
+        """
+        用固定数量的工作线程消费按就绪时间排序的字节区间堆，返回失败的数据块编号
+        堆元素为 (就绪时间, 数据块编号, 起始, 结束, 重试次数)：
+        失败的区间带着退避后的就绪时间重新入堆，工作线程不会为等待重试而空占；
+        中途断开的区间只把未下载的尾部重新入堆，已写入的部分保留在文件中
+        """
+        max_retries = self._max_retries
+        work_heap = [(0, chunk_id, start, end, 0) for chunk_id, (start, end) in enumerate(ranges)]
+        heapq.heapify(work_heap)
+        
+        # 入堆和完成都会通知，等待退避的线程能立即取走新入堆的就绪区间
+        state_cond = threading.Condition()
+        failed_chunks = []
+        pending = len(ranges)
+        
+        def put(item):
+            """区间重新入堆并唤醒一个等待中的工作线程"""
+            with state_cond:
+                heapq.heappush(work_heap, item)
+                state_cond.notify()
+        
+        def take():
+            """取出一个已就绪的区间；堆顶未就绪时最多等到它就绪，全部完成时返回 None"""
+            with state_cond:
+                while pending:
+                    delay = None
+                    if work_heap:
+                        delay = work_heap[0][0] - time.monotonic()
+                        if delay <= 0:
+                            return heapq.heappop(work_heap)
+                    state_cond.wait(delay)
+                return None
+        
+        def finish(chunk_id, error=None):
+            """一个数据块完成或最终失败，全部结束时唤醒所有工作线程退出"""
+            nonlocal pending
+            with state_cond:
+                pending -= 1
+                if error:
+                    failed_chunks.append(chunk_id)
+                    print(f"\n❌ 数据块 {chunk_id} 最终失败: {error}")
+                if pending == 0:
+                    state_cond.notify_all()
+        
+        def worker():
+            while True:
+                item = take()
+                if item is None:
+                    break
+                _, chunk_id, start, end, attempt = item
+                
+                _, downloaded, error = self.download_chunk(url, start, end, chunk_id, fd)
+                if not error:
+                    finish(chunk_id)
+                elif downloaded > 0:
+                    # 已有进展：只把剩余尾部立即重新入堆，重试次数重新计算
+                    put((time.monotonic(), chunk_id, start + downloaded, end, 0))
+                elif attempt < max_retries:
+                    wait_time = min(2 ** attempt, 10)  # 指数退避，最大10秒
+                    print(f"\n⚠️  数据块 {chunk_id} 下载失败，{wait_time}秒后重试 ({attempt + 1}/{max_retries})")
+                    put((time.monotonic() + wait_time, chunk_id, start, end, attempt + 1))
+                else:
+                    finish(chunk_id, error)
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in range(workers):
+                executor.submit(worker)
+        
+        return failed_chunks
+    
+    def release_page_cache(self, fd, offset, length):
+        """
+        提示内核这段数据不会再读：脏页开始回写，已回写的页直接释放
+        视频写入后很久才会播放，留在页缓存里只会挤掉其他有用的缓存
+        """
+        if not self._drop_page_cache:
+            return
+        try:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+    
+    def tick_loop(self, stop_event):
+        """定时线程：每个更新间隔置一次刷新标记，读取循环只需检查标记而无需读时钟"""
+        while not stop_event.wait(self._update_interval):
+            self._should_update = True
+    
+    def add_progress(self, n):
+        """在线程本地累加已下载字节数，满1MB才并入共享计数"""
+        pending = getattr(self._local, 'pending', 0) + n
+        if pending >= self._flush_bytes:
+            with self.progress_lock:
+                self.total_downloaded += pending
+            pending = 0
+        self._local.pending = pending
+    
+    def flush_progress(self):
+        """把本线程尚未并入的字节数并入共享计数（数据块结束时调用）"""
+        pending = getattr(self._local, 'pending', 0)
+        if pending:
+            with self.progress_lock:
+                self.total_downloaded += pending
+            self._local.pending = 0
+    
+    def progress_reporter(self, stop_event):
+        """进度线程：按更新间隔刷新显示，下载线程不再负责格式化输出"""
+        while not stop_event.wait(self._update_interval):
+            self.update_progress()
+    
+    async def download_chunk_async(self, session, url, start, end, chunk_id, fd):
+        """
+        异步下载单个数据块，直接写入输出文件的对应偏移位置
+        失败后从已写入位置续传，只有连续多次没有任何进展才放弃
+        """
+        max_retries = self._max_retries
+        expected_size = end - start + 1
+        chunk_size_downloaded = 0
+        retry_count = 0
+        
+        while True:
+            headers = {'Range': f'bytes={start + chunk_size_downloaded}-{end}'}
+            downloaded_before = chunk_size_downloaded
+            try:
+                async with session.get(url, headers=headers) as response:
+                    response.raise_for_status()
+                    # 续传时请求的是剩余尾部，响应必须从尾部起点开始
+                    check_range_response(response.status, response.headers, start + downloaded_before)
+                    
+                    async for data in response.content.iter_chunked(self._chunk_io_size):
+                        # 读满本区间即停止，不写入多余的数据
+                        data = data[:expected_size - chunk_size_downloaded]
+                        os.pwrite(fd, data, start + chunk_size_downloaded)
+                        chunk_size_downloaded += len(data)
+                        
+                        # 事件循环是单线程的，更新进度无需加锁
+                        self.total_downloaded += len(data)
+                        
+                        if chunk_size_downloaded >= expected_size:
+                            break
+                
+                # 验证下载完整性（文件已预分配，缺少的部分会变成空洞，必须补齐）
+                if chunk_size_downloaded < expected_size:
+                    raise Exception(f"数据块不完整: 期望 {expected_size}, 实际 {chunk_size_downloaded}")
+                
+                self.release_page_cache(fd, start, chunk_size_downloaded)
+                return chunk_id, chunk_size_downloaded, None
+                
+            except Exception as e:
+                if chunk_size_downloaded > downloaded_before:
+                    # 有进展：立即续传剩余部分，重试次数重新计算
+                    retry_count = 0
+                    continue
+                
+                if retry_count == max_retries:
+                    return chunk_id, chunk_size_downloaded, str(e)
+                
                 wait_time = min(2 ** retry_count, 10)  # 指数退避，最大10秒
-                print(f"\n⚠️  数据块 {chunk_id} 下载失败，{wait_time}秒后重试 ({retry_count + 1}/{max_retries})")
-                time.sleep(wait_time)
-                return self.download_chunk(url, start, end, chunk_id, temp_dir, retry_count + 1)
-            else:
-                return chunk_id, 0, str(e)
+                retry_count += 1
+                print(f"\n⚠️  数据块 {chunk_id} 下载失败，{wait_time}秒后重试 ({retry_count}/{max_retries})")
+                await asyncio.sleep(wait_time)
     
-    def update_progress(self):
-        """更新下载进度显示"""
-        if not self.progress_config.get('verbose', True):
+    async def download_chunks_async(self, url, ranges, fd):
+        """在一个事件循环中并发下载所有数据块，返回失败的数据块编号"""
+        connector = aiohttp.TCPConnector(limit=self.max_threads, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self._timeout,
+                                        sock_read=self._timeout)
+        
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers=dict(self.session.headers)) as session:
+            results = await asyncio.gather(*(
+                self.download_chunk_async(session, url, start, end, chunk_id, fd)
+                for chunk_id, (start, end) in enumerate(ranges)
+            ))
+        
+        failed_chunks = []
+        for chunk_id, downloaded, error in results:
+            if error:
+                failed_chunks.append(chunk_id)
+                print(f"\n❌ 数据块 {chunk_id} 最终失败: {error}")
+        return failed_chunks
+    
+    def update_progress(self, force=False):
+        """更新下载进度显示，进度条和ETA都没有明显变化时不重复输出（force 时总是输出）"""
+        if not self._verbose:
             return
             
         if self.total_size > 0:
-            progress = (self.total_downloaded / self.total_size) * 100
-            elapsed_time = time.time() - self.start_time
+            downloaded = self.total_downloaded
+            progress = (downloaded / self.total_size) * 100
+            elapsed_time = time.monotonic() - self.start_time
             
-            progress_bar = self.get_progress_bar(progress)
+            filled = max(0, min(int(30 * progress / 100), 30))
             
             if elapsed_time > 0:
-                speed = self.total_downloaded / elapsed_time
+                speed = downloaded / elapsed_time
                 speed_mb = speed / (1024 * 1024)
                 
                 # 计算ETA
-                if speed > 0:
-                    remaining_bytes = self.total_size - self.total_downloaded
-                    eta = remaining_bytes / speed
-                    eta_str = self.format_time(eta)
-                else:
-                    eta_str = "N/A"
+                eta = (self.total_size - downloaded) / speed if speed > 0 else None
+                
+                if (not force and filled == self._last_filled and eta is not None
+                        and self._last_eta is not None and abs(eta - self._last_eta) <= 1):
+                    return
+                self._last_filled = filled
+                self._last_eta = eta
+                
+                progress_bar = self._BARS[filled]
+                eta_str = self.format_time(eta) if eta is not None else "N/A"
                 
                 # 格式化显示
-                downloaded_mb = self.total_downloaded / (1024 * 1024)
+                downloaded_mb = downloaded / (1024 * 1024)
                 total_mb = self.total_size / (1024 * 1024)
                 
                 status = f"\r{progress_bar} {progress:.1f}% | "
                 status += f"{downloaded_mb:.1f}MB/{total_mb:.1f}MB"
                 
-                if self.progress_config.get('show_speed', True):
+                if self._show_speed:
                     status += f" | {speed_mb:.2f}MB/s"
                 
-                if self.progress_config.get('show_eta', True):
+                if self._show_eta:
                     status += f" | ETA: {eta_str}"
                 
                 print(status, end='', flush=True)
     
     def get_progress_bar(self, progress, width=30):
-        """生成进度条"""
-        filled = int(width * progress / 100)
+        """生成进度条（默认宽度直接查表）"""
+        filled = max(0, min(int(width * progress / 100), width))
+        if width == 30:
+            return self._BARS[filled]
         bar = '█' * filled + '░' * (width - filled)
         return f"[{bar}]"
     
     def format_time(self, seconds):
         """格式化时间显示"""
-        if seconds < 60:
-            return f"{int(seconds)}s"
-        elif seconds < 3600:
-            return f"{int(seconds//60)}m{int(seconds%60)}s"
-        else:
-            return f"{int(seconds//3600)}h{int((seconds%3600)//60)}m"
-    
-    def merge_chunks(self, temp_dir, output_file, num_chunks):
-        """合并所有数据块"""
-        print(f"\n🔧 正在合并 {num_chunks} 个数据块...")
-        
-        try:
-            with open(output_file, 'wb') as outfile:
-                for i in range(num_chunks):
-                    chunk_file = os.path.join(temp_dir, f'chunk_{i:04d}.tmp')
-                    if os.path.exists(chunk_file):
-                        with open(chunk_file, 'rb') as infile:
-                            while True:
-                                chunk = infile.read(64*1024)  # 64KB 块读取
-                                if not chunk:
-                                    break
-                                outfile.write(chunk)
-                        os.remove(chunk_file)
-                        
-                        # 显示合并进度
-                        progress = ((i + 1) / num_chunks) * 100
-                        print(f"\r🔧 合并进度: {progress:.1f}%", end='', flush=True)
-                    else:
-                        print(f"\n⚠️  警告: 数据块 {i} 不存在")
-            
-            # 清理临时目录
-            try:
-                if os.path.exists(temp_dir):
-                    os.rmdir(temp_dir)
-            except:
-                pass
-                
-            print(f"\n✅ 文件合并完成: {output_file}")
-            return True
-            
-        except Exception as e:
-            print(f"\n❌ 合并文件失败: {str(e)}")
-            return False
+        minutes, seconds = divmod(int(seconds), 60)
+        if not minutes:
+            return '%ds' % seconds
+        hours, minutes = divmod(minutes, 60)
+        if not hours:
+            return '%dm%ds' % (minutes, seconds)
+        return '%dh%dm' % (hours, minutes)
     
     def generate_filename(self, title, video_id=None):
         """生成安全的文件名"""
         # 清理非法字符
-        safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_', '.', '(', ')')).strip()
+        safe_title = title.translate(self._FILENAME_TBL).strip()
         
         # 限制长度
         max_length = self.file_config.get('max_filename_length', 200)
@@ -318,23 +577,22 @@ class EnhancedChunkDownloader:
         
         return f"{safe_title}.mp4"
     
-    def cleanup_failed_download(self, temp_dir):
-        """清理失败的下载临时文件"""
+    def cleanup_failed_download(self, output_file):
+        """清理下载失败留下的不完整文件"""
         if not self.file_config.get('auto_cleanup', True):
             return
             
         try:
-            if os.path.exists(temp_dir):
-                for file in os.listdir(temp_dir):
-                    os.remove(os.path.join(temp_dir, file))
-                os.rmdir(temp_dir)
-                print("🧹 已清理临时文件")
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+                print("🧹 已清理不完整的文件")
         except Exception as e:
-            print(f"⚠️  清理临时文件失败: {str(e)}")
+            print(f"⚠️  清理不完整的文件失败: {str(e)}")
     
     def download_video(self, youtube_url, output_dir=None):
         """主下载函数"""
         output_dir = output_dir or self.file_config.get('default_output_dir', './downloads')
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
         
         print("🎯 分析视频信息...")
         
@@ -355,15 +613,13 @@ class EnhancedChunkDownloader:
             return self.fallback_download(video_url, title, output_dir)
         
         print("🧪 测试分块下载支持...")
-        if not self.test_range_support(video_url):
+        supports_range, file_size, first_byte = self.probe_range(video_url)
+        if not supports_range:
             print("⚠️  服务器不支持分块下载，切换到标准模式")
             return self.fallback_download(video_url, title, output_dir)
         
         print("✅ 服务器支持分块下载")
         
-        # 获取精确文件大小
-        print("📏 获取文件大小...")
-        file_size = self.get_accurate_file_size(video_url)
         if file_size == 0:
             # 使用预估大小
             file_size = video_info.get('filesize', 0)
@@ -378,76 +634,100 @@ class EnhancedChunkDownloader:
         
         # 计算最佳分块策略
         optimal_chunks = self.calculate_optimal_chunks(file_size)
-        chunk_size = file_size // optimal_chunks
         
-        print(f"🔀 分块策略: {optimal_chunks} 个线程，每块约 {chunk_size / (1024*1024):.2f} MB")
+        # 文件按 chunk_size 切成远多于线程数的小区间，空闲线程随时领取下一个，
+        # 个别慢连接只拖慢它手上的一小块而不是整个文件的 1/N；单线程时一次请求整个文件
+        chunk_size = self.chunk_size if optimal_chunks > 1 else file_size
         
-        # 准备文件路径
-        os.makedirs(output_dir, exist_ok=True)
-        timestamp = int(time.time())
-        temp_dir = os.path.join(output_dir, f"{self.file_config['temp_dir_prefix']}{timestamp}")
-        os.makedirs(temp_dir, exist_ok=True)
+        print(f"🔀 分块策略: {optimal_chunks} 个线程，每块 {chunk_size / (1024*1024):.2f} MB")
         
         filename = self.generate_filename(title, video_info['info'].get('id'))
         output_file = os.path.join(output_dir, filename)
         
+        # 计算每个数据块的字节区间
+        ranges = [(start, min(start + chunk_size, file_size) - 1)
+                  for start in range(0, file_size, chunk_size)]
+        
+        # 探测请求已取回首字节，第一个区间从其后开始
+        if first_byte:
+            ranges[0] = (len(first_byte), ranges[0][1])
+            # 文件只有这一个字节时探测已取回全部内容，无需再请求
+            ranges = [(start, end) for start, end in ranges if start <= end]
+        
         # 开始分块下载
         print("🚀 开始分块下载...")
         print("=" * 60)
         
-        self.start_time = time.time()
+        self.start_time = time.monotonic()
         self.total_downloaded = 0
-        self.last_update_time = 0
+        self._last_filled = -1
+        self._last_eta = None
         
-        with ThreadPoolExecutor(max_workers=optimal_chunks) as executor:
-            futures = []
+        # 预分配输出文件，所有数据块直接写入对应偏移，无需临时文件与合并
+        fd = None
+        reporter = None
+        stop_event = threading.Event()
+        try:
+            fd = os.open(output_file, os.O_WRONLY | os.O_CREAT, 0o644)
+            os.ftruncate(fd, file_size)
+            try:
+                # 一次性预留连续的磁盘空间，避免并发写入时文件系统逐块扩展
+                os.posix_fallocate(fd, 0, file_size)
+            except (AttributeError, OSError):
+                pass  # 非Linux或文件系统不支持时保持稀疏文件
+            if first_byte:
+                os.pwrite(fd, first_byte, 0)
+                self.total_downloaded += len(first_byte)
             
-            for i in range(optimal_chunks):
-                start = i * chunk_size
-                end = start + chunk_size - 1
-                if i == optimal_chunks - 1:
-                    end = file_size - 1
-                
-                future = executor.submit(self.download_chunk, video_url, start, end, i, temp_dir)
-                futures.append(future)
+            # 进度线程（输出文件就绪后再启动）
+            reporter = threading.Thread(target=self.progress_reporter, args=(stop_event,), daemon=True)
+            reporter.start()
             
-            # 等待所有下载完成
-            failed_chunks = []
-            completed_chunks = 0
+            if self._h2:
+                print("🔗 使用HTTP/2多路复用，所有数据块共用一条连接")
             
-            for future in as_completed(futures):
-                chunk_id, downloaded, error = future.result()
-                completed_chunks += 1
-                
-                if error:
-                    failed_chunks.append(chunk_id)
-                    print(f"\n❌ 数据块 {chunk_id} 最终失败: {error}")
-                else:
-                    if self.progress_config.get('verbose'):
-                        print(f"\n✅ 数据块 {chunk_id} 完成 ({completed_chunks}/{optimal_chunks})")
+            if not ranges:
+                failed_chunks = []
+            elif aiohttp is not None and not self._h2:
+                # 异步模式：单个事件循环驱动所有数据块
+                failed_chunks = asyncio.run(self.download_chunks_async(video_url, ranges, fd))
+            else:
+                failed_chunks = self.download_ranges(video_url, ranges, fd, optimal_chunks)
+        except OSError as e:
+            print(f"\n❌ 写入输出文件失败: {str(e)}")
+            failed_chunks = None
+        finally:
+            stop_event.set()
+            if reporter is not None:
+                reporter.join()
+            if fd is not None:
+                os.close(fd)
+        
+        if failed_chunks is None:
+            self.cleanup_failed_download(output_file)
+            return False
+        
+        if not failed_chunks:
+            self.update_progress(force=True)
         
         print()  # 换行
         
         if failed_chunks:
             print(f"❌ 有 {len(failed_chunks)} 个数据块下载失败")
-            self.cleanup_failed_download(temp_dir)
+            self.cleanup_failed_download(output_file)
             return False
         
-        # 合并文件
-        success = self.merge_chunks(temp_dir, output_file, optimal_chunks)
+        elapsed_time = time.monotonic() - self.start_time
+        avg_speed = (file_size / (1024*1024)) / elapsed_time if elapsed_time > 0 else 0
         
-        if success:
-            elapsed_time = time.time() - self.start_time
-            avg_speed = (file_size / (1024*1024)) / elapsed_time if elapsed_time > 0 else 0
-            
-            print("=" * 60)
-            print("🎉 下载完成!")
-            print(f"⏱️  总用时: {self.format_time(elapsed_time)}")
-            print(f"📈 平均速度: {avg_speed:.2f} MB/s")
-            print(f"💾 文件位置: {output_file}")
-            print(f"📦 文件大小: {os.path.getsize(output_file) / (1024*1024):.2f} MB")
+        print("=" * 60)
+        print("🎉 下载完成!")
+        print(f"⏱️  总用时: {self.format_time(elapsed_time)}")
+        print(f"📈 平均速度: {avg_speed:.2f} MB/s")
+        print(f"💾 文件位置: {output_file}")
+        print(f"📦 文件大小: {os.path.getsize(output_file) / (1024*1024):.2f} MB")
         
-        return success
+        return True
     
     def fallback_download(self, video_url, title, output_dir):
         """标准下载方法"""
@@ -463,21 +743,38 @@ class EnhancedChunkDownloader:
             total_size = int(response.headers.get('content-length', 0))
             downloaded = 0
             
-            start_time = time.time()
+            start_time = time.monotonic()
+            
+            # 由定时线程决定何时刷新进度，不再每读1MB就读时钟并打印
+            stop_event = threading.Event()
+            ticker = threading.Thread(target=self.tick_loop, args=(stop_event,), daemon=True)
+            ticker.start()
             
-            with open(output_file, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
+            # 复用1MB缓冲区直接读入，避免每8KB创建一个bytes对象
+            raw = response.raw
+            raw.decode_content = True
+            buffer = bytearray(1024 * 1024)
+            view = memoryview(buffer)
+            
+            try:
+                with open(output_file, 'wb') as f:
+                    while True:
+                        n = raw.readinto(view)
+                        if not n:
+                            break
+                        f.write(view[:n])
+                        downloaded += n
                         
-                        if total_size > 0:
+                        if self._should_update and total_size > 0:
+                            self._should_update = False
                             progress = (downloaded / total_size) * 100
-                            elapsed = time.time() - start_time
+                            elapsed = time.monotonic() - start_time
                             speed = (downloaded / (1024*1024)) / elapsed if elapsed > 0 else 0
                             
                             print(f"\r📥 {progress:.1f}% | {downloaded/(1024*1024):.1f}MB | {speed:.2f}MB/s", 
                                   end='', flush=True)
+            finally:
+                stop_event.set()
             
             print(f"\n✅ 下载完成: {output_file}")
             return True
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+文件名工具
+各下载器共用的文件名字符过滤表
+"""
+
+class SafeCharTable(dict):
+    """
+    str.translate 使用的字符表：按需判断并缓存每个字符是否保留
+    字母数字（含中文等）和 keep 中的字符保留，其余删除
+    """
+    def __init__(self, keep):
+        super().__init__()
+        self.keep = keep
+
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        value = codepoint if char.isalnum() or char in self.keep else None
+        self[codepoint] = value
+        return value
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+HTTP 工具
+各下载器共用的 Range 响应校验
+"""
+
+import re
+
+# Content-Range: bytes 起始-结束/总大小
+_CONTENT_RANGE_START_RE = re.compile(r'bytes (\d+)-')
+
+def check_range_response(status_code, headers, start):
+    """
+    确认服务器按请求返回了从 start 开始的部分内容
+    服务器忽略Range时会返回200和完整文件，写入分块偏移处会得到错误的数据，必须当作失败
+    """
+    if status_code != 206:
+        raise Exception(f"服务器未按Range返回部分内容 (状态码: {status_code})")
+
+    match = _CONTENT_RANGE_START_RE.match(headers.get('content-range', ''))
+    if not match or int(match.group(1)) != start:
+        raise Exception(f"Content-Range 与请求的起始位置 {start} 不符: {headers.get('content-range')}")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+视频信息缓存
+同一链接短时间内重复解析时直接复用 yt-dlp 的结果（内存 + 磁盘两级缓存）
+"""
+
+import os
+import json
+import copy
+import time
+import hashlib
+import threading
+from config import CACHE_CONFIG
+
+_INFO_CACHE = {}  # 缓存键 -> (写入时间, info)
+_INFO_CACHE_LOCK = threading.Lock()
+
+def _cache_key(url, ydl_opts):
+    """缓存键包含格式表达式，不同格式选择的结果互不混用"""
+    return f"{url}|{ydl_opts.get('format', '')}"
+
+def _disk_cache_path(key):
+    """磁盘缓存文件路径"""
+    cache_dir = os.path.expanduser(CACHE_CONFIG.get('cache_dir', '~/.cache/mp4dl'))
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+def _read_disk_cache(path, ttl):
+    """读取未过期的磁盘缓存，不存在或已过期时返回 None"""
+    try:
+        mtime = os.path.getmtime(path)
+        if time.time() - mtime >= ttl:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return mtime, json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_disk_cache(path, info):
+    """写入磁盘缓存（先写临时文件再替换，避免并发读到半个文件）"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"⚠️  写入信息缓存失败: {str(e)}")
+
+def get_cached_info(url, ydl_opts, ydl=None):
+    """
+    获取视频信息，优先使用缓存
+    传入 ydl 时复用该 YoutubeDL 实例解析，否则按 ydl_opts 新建一个
+    返回的是缓存的副本，调用方可以放心修改
+    """
+    key = _cache_key(url, ydl_opts)
+    ttl = CACHE_CONFIG.get('info_ttl', 600)
+
+    # 1. 内存缓存
+    with _INFO_CACHE_LOCK:
+        cached = _INFO_CACHE.get(key)
+    if cached and time.time() - cached[0] < ttl:
+        return copy.deepcopy(cached[1])
+
+    # 2. 磁盘缓存
+    use_disk = CACHE_CONFIG.get('enable_disk_cache', True)
+    path = _disk_cache_path(key)
+    if use_disk:
+        cached = _read_disk_cache(path, ttl)
+        if cached:
+            with _INFO_CACHE_LOCK:
+                _INFO_CACHE[key] = cached
+            return copy.deepcopy(cached[1])
+
+    # 3. 调用 yt-dlp 解析
+    if ydl is None:
+        import yt_dlp
+        with yt_dlp.YoutubeDL(ydl_opts) as new_ydl:
+            info = new_ydl.sanitize_info(new_ydl.extract_info(url, download=False))
+    else:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+    with _INFO_CACHE_LOCK:
+        _INFO_CACHE[key] = (time.time(), info)
+    if use_disk:
+        _write_disk_cache(path, info)
+
+    return copy.deepcopy(info)